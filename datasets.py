@@ -35,20 +35,21 @@ def plot(X, y, fun, error, space):
     Plot feature space with decision function and samples, and the error zone.
     """
 
-    x_lower = lambda x: fun(x) - error
-    x_upper = lambda x: fun(x) + error
-
+    # Evaluate the decision function, its error bounds and the colors once, then reuse them in both figures
     x_decision_fun = np.linspace(space[0][0], space[0][1], 100)
     y_decision_fun = fun(x_decision_fun)
+    y_lower = y_decision_fun - error
+    y_upper = y_decision_fun + error
+    colors = colormap(y)
 
     fig = plt.figure()
-    plt.scatter(*X.T, c=colormap(y), edgecolors='k', alpha=0.4)
+    plt.scatter(*X.T, c=colors, edgecolors='k', alpha=0.4)
     plt.xlim([space[0][0], space[0][1]])
     plt.ylim([space[1][0], space[1][1]])
     plt.title('Samples')
     plt.plot(x_decision_fun, y_decision_fun, 'k-', linewidth=2)
-    plt.plot(x_decision_fun, x_lower(x_decision_fun), linewidth=2, color='#454545')
-    plt.plot(x_decision_fun, x_upper(x_decision_fun), linewidth=2, color='#454545')
+    plt.plot(x_decision_fun, y_lower, linewidth=2, color='#454545')
+    plt.plot(x_decision_fun, y_upper, linewidth=2, color='#454545')
     plt.xlabel('$x_1$')
     plt.ylabel('$x_2$')
     plt.show()
@@ -59,9 +60,9 @@ def plot(X, y, fun, error, space):
     plt.ylim([space[1][0], space[1][1]])
     plt.title('Noise Zone')
     plt.plot(x_decision_fun, y_decision_fun, 'k-', linewidth=2)
-    plt.plot(x_decision_fun, x_lower(x_decision_fun), linewidth=2, color='#454545')
-    plt.plot(x_decision_fun, x_upper(x_decision_fun), linewidth=2, color='#454545')
-    plt.fill_between(x_decision_fun, x_lower(x_decision_fun), x_upper(x_decision_fun))
+    plt.plot(x_decision_fun, y_lower, linewidth=2, color='#454545')
+    plt.plot(x_decision_fun, y_upper, linewidth=2, color='#454545')
+    plt.fill_between(x_decision_fun, y_lower, y_upper)
     plt.xlabel('$x_1$')
     plt.ylabel('$x_2$')
     plt.show()
@@ -70,26 +71,17 @@ def plot(X, y, fun, error, space):
 
 def save_data(X, y, filename: str):
 
-    file_data = open(filename + '.txt', 'w')
-    file_train_data = open(filename + '_train.txt', 'w')
-    file_test_data = open(filename + '_test.txt', 'w')
-    file_val_data = open(filename + '_val.txt', 'w')
-
     y = y.reshape(-1, 1)
 
     # data split 70/15/15 ratio
     X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.33, random_state=42)
     X_test, X_val, y_test, y_val = train_test_split(X_test, y_test, test_size=0.5, random_state=42)
 
-    np.savetxt(file_data, np.hstack((X, y)))
-    np.savetxt(file_train_data, np.hstack((X_train, y_train)))
-    np.savetxt(file_test_data, np.hstack((X_test, y_test)))
-    np.savetxt(file_val_data, np.hstack((X_val, y_val)))
-
-    file_data.close()
-    file_train_data.close()
-    file_test_data.close()
-    file_val_data.close()
+    # Binary .npy files store the samples losslessly and load much faster than savetxt's text format
+    np.save(filename + '.npy', np.hstack((X, y)))
+    np.save(filename + '_train.npy', np.hstack((X_train, y_train)))
+    np.save(filename + '_test.npy', np.hstack((X_test, y_test)))
+    np.save(filename + '_val.npy', np.hstack((X_val, y_val)))
 
 
 def parabola(x):
@@ -17,6 +17,20 @@ warnings.filterwarnings('ignore')
 device = "mps" if torch.backends.mps.is_available() else 'cpu'
 
 
+def compile_forward(module):
+    """
+    Compile the forward pass of the given module with torch.compile where a working backend is available,
+    otherwise return the eager forward unchanged. Only the bound forward is compiled, so the module itself
+    stays a plain nn.Module and its state-dict keys do not depend on the installed torch version. The
+    inductor backend gained MPS support only late in the 2.x line, so on the MPS device the eager forward
+    is kept instead of risking a backend failure on the first call.
+    """
+    if hasattr(torch, 'compile') and device not in ('mps',):
+        return torch.compile(module.forward)
+
+    return module.forward
+
+
 class SurrogateNetwork(nn.Module):
     def __init__(self, input_dim):
         super(SurrogateNetwork, self).__init__()
@@ -27,9 +41,10 @@ class SurrogateNetwork(nn.Module):
             nn.Linear(25, 1),
             nn.Softplus()
         )
+        self._forward = compile_forward(self.feed_forward)
 
     def forward(self, x):
-        return self.feed_forward(x)
+        return self._forward(x)
 
     def freeze_model(self):
         """
@@ -71,6 +86,7 @@ class TreeNet(nn.Module):
             nn.Tanh(),
             nn.Linear(10, 1)
         )
+        self._forward = compile_forward(self.feed_forward)
         self.surrogate_network = SurrogateNetwork(self.parameters_to_vector().numel())
         self.surrogate_network.freeze_model()
 
@@ -79,9 +95,9 @@ class TreeNet(nn.Module):
         self.random_seeds = np.random.randint(1, 100, 10)
 
     def forward(self, x):
-        return self.feed_forward(x)
+        return self._forward(x)
 
-    def compute_APL(self, X):
+    def compute_APL(self, X, X_tree=None):
         """
         Compute average decision path length given input data. It computes the how many decision nodes one has to
         traverse on average for one data instance.
@@ -91,6 +107,9 @@ class TreeNet(nn.Module):
 
         X: Input features
 
+        X_tree: Input features as numpy array, default None. Pass the precomputed array when computing the APL
+        repeatedly on the same data to avoid one host copy per call.
+
         Returns
         -------
 
@@ -109,7 +128,8 @@ class TreeNet(nn.Module):
         self.unfreeze_model()
         self.train()
 
-        X_tree = X.cpu().detach().numpy()
+        if X_tree is None:
+            X_tree = X.cpu().detach().numpy()
 
         path_lengths = []
 
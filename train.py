@@ -9,7 +9,6 @@ from datasets import parabola, cos, sample_2D_data
 import networks
 from utils import *
 import argparse
-from PIL import Image as ImagePIL
 
 np.random.seed(5555)
 torch.random.manual_seed(5255)
@@ -66,10 +65,10 @@ def resample_data():
 
     X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.20, random_state=42)
 
-    X_train = torch.tensor(X_train, dtype=torch.float).to(device)
-    X_test = torch.tensor(X_test, dtype=torch.float).to(device)
-    y_train = torch.tensor(y_train.reshape(-1, 1), dtype=torch.float).to(device)
-    y_test = torch.tensor(y_test.reshape(-1, 1), dtype=torch.float).to(device)
+    X_train = torch.as_tensor(X_train, dtype=torch.float).to(device)
+    X_test = torch.as_tensor(X_test, dtype=torch.float).to(device)
+    y_train = torch.as_tensor(y_train.reshape(-1, 1), dtype=torch.float).to(device)
+    y_test = torch.as_tensor(y_test.reshape(-1, 1), dtype=torch.float).to(device)
 
     data_train = TensorDataset(X_train, y_train)
     data_train_loader = DataLoader(dataset=data_train, batch_size=64, shuffle=True)
@@ -144,10 +143,10 @@ def snap_shot_train(data_test_loader, criterion, lambda_, model, accuracy, epoch
 
     data_train_loader_, data_test_loader_ = resample_data()
 
-    with torch.no_grad():
+    with torch.inference_mode():
         # Test with training data
         for i, batch in enumerate(data_train_loader_):
-            x, y = batch[0].to(device), batch[1].to(device)
+            x, y = batch[0].to(device, non_blocking=True), batch[1].to(device, non_blocking=True)
             X_train_temp.append(x)
             y_train_temp.append(y)
 
@@ -163,7 +162,7 @@ def snap_shot_train(data_test_loader, criterion, lambda_, model, accuracy, epoch
     X_test_, y_test_ = dataloader_to_numpy(data_test_loader_)
 
     _ = build_decision_tree(X_train_temp, y_train_predicted, X_test_, y_test_, space,
-                            f"{path}/decision_tree-snapshot-epoch-{epoch}", epoch=epoch)
+                            f"{path}/decision_tree-snapshot-epoch-{epoch}", epoch=epoch, render_tree=False)
 
     plot_title = f'Network Contourplot, $\lambda$: {lambda_}, Accuracy: {accuracy:.2f}'
     fig_file_name = f'{path}/fig_train_prediction-snapshot-epoch-{epoch}.png'
@@ -172,7 +171,7 @@ def snap_shot_train(data_test_loader, criterion, lambda_, model, accuracy, epoch
 
 def train_surrogate_model(X, y, criterion, optimizer, model):
 
-    X_train = torch.vstack(X).detach()
+    X_train = X.detach()
     y_train = torch.tensor([y], dtype=torch.float).T.to(device)
 
     model.surrogate_network.to(device)
@@ -185,23 +184,30 @@ def train_surrogate_model(X, y, criterion, optimizer, model):
 
     training_loss = []
 
+    # Loss normaliser; y_train is fixed, so compute it once instead of per batch
+    y_train_var = torch.var(y_train) + 0.01
+
     model.surrogate_network.train()
 
     for epoch in range(num_epochs):
-        batch_loss = []
+        batch_loss_sum = 0.0
+        num_batches = 0
 
         for (x, y) in data_train_loader:
             y_hat = model.surrogate_network(x)
             loss = criterion(input=y_hat, target=y)
-            optimizer.zero_grad()
+            optimizer.zero_grad(set_to_none=True)
             loss.backward()
             optimizer.step()
 
-            batch_loss.append(loss.item() / (torch.var(y_train).item() + 0.01))
+            # Accumulate on device, synchronize only once per epoch
+            batch_loss_sum = batch_loss_sum + loss.detach() / y_train_var
+            num_batches += 1
 
-        training_loss.append(np.array(batch_loss).mean())
+        epoch_loss = (batch_loss_sum / num_batches).item()
+        training_loss.append(epoch_loss)
 
-        print(f'Surrogate Model: Epoch [{epoch + 1}/{num_epochs}, Loss: {np.array(batch_loss).mean():.4f}]')
+        print(f'Surrogate Model: Epoch [{epoch + 1}/{num_epochs}, Loss: {epoch_loss:.4f}]')
 
     del X
     del y
@@ -242,7 +248,12 @@ def train(data_train_loader, data_test_loader, data_val_loader, writer, path):
     criterion_sr = nn.MSELoss()
     optimizer_sr = Adam(model.surrogate_network.parameters(), lr=1e-3, weight_decay=1e-5)
 
-    input_surrogate = []
+    # Preallocate the surrogate input buffer (one row per collected parameter vector) instead of
+    # vstacking a growing Python list every epoch
+    num_params = model.parameters_to_vector().numel()
+    capacity = num_random_restarts + total_num_epochs * len(data_train_loader)
+    input_surrogate = torch.empty((capacity, num_params), device=device)
+    num_collected = 0
     APLs_surrogate = []
 
     APLs_truth = []
@@ -263,15 +274,21 @@ def train(data_train_loader, data_test_loader, data_val_loader, writer, path):
         data_train_loader_new, _ = resample_data()
 
         model.reset_outer_weights()
-        input_surrogate.append(model.parameters_to_vector())
-        APL = model.compute_APL(data_train_loader_new.dataset[:][0])
+        input_surrogate[num_collected] = model.parameters_to_vector().detach()
+        num_collected += 1
+        APL = model.compute_APL(data_train_loader_new.dataset.tensors[0])
         APLs_surrogate.append(APL)
         print(f'Random restart [{i + 1}/{num_random_restarts}]')
 
+    # The training loader is fixed, so its feature tensor is fetched once and reused every epoch
+    X_train_device = data_train_loader.dataset.tensors[0]
+
     for epoch in range(total_num_epochs):
         model.train()
-        batch_loss_val = []
-        batch_loss_without_reg = []
+        batch_loss_val_sum = 0.0
+        num_batches_val = 0
+        batch_loss_without_reg_sum = 0.0
+        num_batches_train = 0
         batch_accuracy = []
 
         if epoch > 0:
@@ -280,11 +297,11 @@ def train(data_train_loader, data_test_loader, data_val_loader, writer, path):
                 lambda_ = cooling_fun(epoch - epochs_warm_up)
                 lambdas.append(lambda_)
 
-            input_surrogate_augmented, APLs_surrogate_augmented = augment_data_with_dirichlet(data_train_loader.dataset[:][0], input_surrogate, networks.TreeNet(input_dim=dim), device, 500)
+            input_surrogate_augmented, APLs_surrogate_augmented = augment_data_with_dirichlet(X_train_device, input_surrogate[:num_collected], networks.TreeNet(input_dim=dim), device, 500)
             model.freeze_model()
             model.surrogate_network.unfreeze_model()
 
-            input_surrogate_augmented = input_surrogate + input_surrogate_augmented
+            input_surrogate_augmented = torch.cat((input_surrogate[:num_collected], input_surrogate_augmented))
             APLs_surrogate_augmented = APLs_surrogate + APLs_surrogate_augmented
             sr_train_loss = train_surrogate_model(input_surrogate_augmented, APLs_surrogate_augmented, criterion_sr, optimizer_sr, model)
             surrogate_training_loss.append(sr_train_loss)
@@ -301,29 +318,32 @@ def train(data_train_loader, data_test_loader, data_val_loader, writer, path):
 
             y_hat = model(x)
 
+            omega = model.compute_APL_prediction()
+
             if epoch > (epochs_warm_up - 1): # regularisation phase
-                omega = model.compute_APL_prediction()
                 loss = criterion(input=y_hat, target=y) + lambda_ * omega
             else: # warm-up phase
                 loss = criterion(input=y_hat, target=y)
                 x_iter_warm_up += 1
 
-            loss_without_reg = criterion(input=y_hat, target=y)  # Only for plotting, not for optimisation
-            batch_loss_without_reg.append(float(loss_without_reg))
-            del loss_without_reg
+            # Only for plotting, not for optimisation; accumulated on device to avoid a sync per batch
+            batch_loss_without_reg_sum = batch_loss_without_reg_sum + criterion(input=y_hat, target=y).detach()
+            num_batches_train += 1
 
-            APL_predictions.append(model.compute_APL_prediction())
+            # Keep the device-side tensor; the single host sync happens when plotting after training
+            APL_predictions.append(omega.detach())
 
             iters_per_epoch += 1 if epoch == 0 else 0
 
-            optimizer.zero_grad()
+            optimizer.zero_grad(set_to_none=True)
             loss.backward()
             optimizer.step()
 
             # Collect weights and APLs for surrogate training
-            input_surrogate.append(model.parameters_to_vector())
+            input_surrogate[num_collected] = model.parameters_to_vector().detach()
+            num_collected += 1
             data_train_loader_new, _ = resample_data()
-            APL = model.compute_APL(data_train_loader_new.dataset[:][0])
+            APL = model.compute_APL(data_train_loader_new.dataset.tensors[0])
             APLs_surrogate.append(APL)
             APLs_truth.append(APL)
 
@@ -342,17 +362,20 @@ def train(data_train_loader, data_test_loader, data_val_loader, writer, path):
         for (x, y) in data_val_loader:
             y_hat = model(x)
             loss = criterion(input=y_hat, target=y)
-            batch_loss_val.append(float(loss))
+            batch_loss_val_sum = batch_loss_val_sum + loss.detach()
+            num_batches_val += 1
             y_hat = torch.where(y_hat > 0.5, 1, 0).cpu().numpy()
             y = y.detach().cpu().numpy()
             batch_accuracy.append(accuracy_score(y, y_hat))
 
             del x, y
 
-        print(f'Epoch: [{epoch + 1}/{total_num_epochs}, Loss: {np.array(batch_loss_without_reg).mean():.4f}]')
+        epoch_loss_without_reg = (batch_loss_without_reg_sum / num_batches_train).item()
+
+        print(f'Epoch: [{epoch + 1}/{total_num_epochs}, Loss: {epoch_loss_without_reg:.4f}]')
 
-        training_loss_without_reg.append(np.array(batch_loss_without_reg).mean())
-        val_loss.append(np.array(batch_loss_val).mean())
+        training_loss_without_reg.append(epoch_loss_without_reg)
+        val_loss.append((batch_loss_val_sum / num_batches_val).item())
         training_accuracy.append(np.array(batch_accuracy).mean())
 
         data_train_loader_new, data_test_loader_new = resample_data()
@@ -361,7 +384,7 @@ def train(data_train_loader, data_test_loader, data_val_loader, writer, path):
 
         ccp_alpha = post_pruning(X_train_new, y_train_new)
         dt = DecisionTreeClassifier(random_state=42, ccp_alpha=ccp_alpha, min_samples_leaf=args.min_samples_leaf)
-        y_hat_ = model(data_train_loader_new.dataset[:][0])
+        y_hat_ = model(data_train_loader_new.dataset.tensors[0])
         y_hat_ = torch.where(y_hat_ > 0.5, 1, 0).detach().cpu().numpy()
         dt.fit(X_train_new, y_hat_)
         acc = accuracy_score(y_test_new, dt.predict(X_test_new))
@@ -393,9 +416,11 @@ def train(data_train_loader, data_test_loader, data_val_loader, writer, path):
     fig.savefig(f'{path}/surrogate_training_loss.png')
     plt.close(fig)
 
+    APL_predictions = torch.cat(APL_predictions).cpu().numpy()
+
     fig = plt.figure()
     plt.plot(range(0, len(APLs_truth)), APLs_truth, color='y', label='true APL')
-    plt.plot(range(0, len(APL_predictions)), [prediction.detach().cpu().numpy() for prediction in APL_predictions], color='g', label='predicted APL $\hat{\Omega}(W)$')
+    plt.plot(range(0, len(APL_predictions)), APL_predictions, color='g', label='predicted APL $\hat{\Omega}(W)$')
     plt.vlines(x_iter_warm_up, 0, max(APLs_truth), linestyles="dashed", colors='r')
     plt.xlabel('iterations')
     plt.ylabel('path length')
@@ -454,6 +479,23 @@ def train(data_train_loader, data_test_loader, data_val_loader, writer, path):
     return model, criterion
 
 
+def load_data(filename):
+    """
+    Load a stored data split, preferring the binary .npy format written by datasets.py and falling back to
+    the legacy whitespace text files.
+
+    Parameters
+    -------
+
+    filename: Path of the data file without extension
+
+    """
+    if os.path.exists(f'{filename}.npy'):
+        return np.load(f'{filename}.npy')
+
+    return np.loadtxt(f'{filename}.txt')
+
+
 def init(path, tb_logs_path):
     global X_train
     global y_train
@@ -462,19 +504,20 @@ def init(path, tb_logs_path):
 
     writer = SummaryWriter(log_dir=tb_logs_path)
 
-    train_data_from_txt = np.loadtxt(f'dataset/{fun_name}/data_{fun_name}_train.txt')
-    test_data_from_txt = np.loadtxt(f'dataset/{fun_name}/data_{fun_name}_test.txt')
-    val_data_from_txt = np.loadtxt(f'dataset/{fun_name}/data_{fun_name}_val.txt')
+    train_data = load_data(f'dataset/{fun_name}/data_{fun_name}_train')
+    test_data = load_data(f'dataset/{fun_name}/data_{fun_name}_test')
+    val_data = load_data(f'dataset/{fun_name}/data_{fun_name}_val')
 
     # Data preparation, first to Tensor then create DataLoader to get mini-batches
-    X_train, y_train = train_data_from_txt[:, :2], train_data_from_txt[:, 2]
-    X_test, y_test = test_data_from_txt[:, :2], test_data_from_txt[:, 2]
-    X_val, y_val = val_data_from_txt[:, :2], val_data_from_txt[:, 2]
+    X_train, y_train = train_data[:, :2], train_data[:, 2]
+    X_test, y_test = test_data[:, :2], test_data[:, 2]
+    X_val, y_val = val_data[:, :2], val_data[:, 2]
     data_train_loader, data_test_loader, data_val_loader = get_data_loader(X_train, y_train, X_test, y_test, X_val,
                                                                            y_val, torch.float, torch.float, args.batch)
 
     # Decision tree, where data is directly fed into
-    tree_accuracy = build_decision_tree(X_train, y_train, X_test, y_test, space, f"{path}/decision_tree_original_data")
+    tree_accuracy = build_decision_tree(X_train, y_train, X_test, y_test, space, f"{path}/decision_tree_original_data",
+                                        writer=writer, tag='Decision tree/Original data')
 
     x_decision_fun = np.linspace(space[0][0], space[0][1], 100)
     y_decision_fun = fun(x_decision_fun)
@@ -500,27 +543,18 @@ def init(path, tb_logs_path):
     ############# Evaluation #####################
     print('Test'.center(len('Test') + 2).center(30, '='))
     model.eval()
-    X_train_temp = []  # Because training data are shuffled, collect them for plotting afterwards
-    y_train_temp = []
 
-    y_train_predicted = []
-    y_test_predicted = []
-    loss_with_train_data = []
-    loss_with_test_data = []
-    with torch.no_grad():
+    # The datasets already sit on the device, so each split is evaluated in one full-batch forward
+    # instead of two separate batch loops
+    X_train_temp, y_train_temp = data_train_loader.dataset.tensors
+    X_test_temp, y_test_temp = data_test_loader.dataset.tensors
+    with torch.inference_mode():
         # Test with training data
-        for (x, y) in data_train_loader:
-            X_train_temp.append(x)
-            y_train_temp.append(y)
-
-            y_hat = model(x)
-            y_train_predicted.append(y_hat)
-            loss = criterion(input=y_hat, target=y)
-            loss_with_train_data.append(loss.item())
+        y_train_predicted = model(X_train_temp)
+        loss_with_train_data = criterion(input=y_train_predicted, target=y_train_temp).item()
 
-        X_train_temp = torch.cat(X_train_temp).cpu().numpy()
-        y_train_temp = torch.cat(y_train_temp).cpu().numpy()
-        y_train_predicted = torch.cat(y_train_predicted)
+        X_train_temp = X_train_temp.cpu().numpy()
+        y_train_temp = y_train_temp.cpu().numpy()
         y_train_predicted = torch.where(y_train_predicted > 0.5, 1, 0).detach().cpu().numpy()
 
         ## PLOTS ##
@@ -529,13 +563,9 @@ def init(path, tb_logs_path):
         model_contour_plot(space, model, plot_title, fig_file_name, X=X_train_temp, y=y_train_predicted)
 
         # Test with test data
-        for (x, y) in data_test_loader:
-            y_hat = model(x)
-            y_test_predicted.append(y_hat)
-            loss = criterion(input=y_hat, target=y)
-            loss_with_test_data.append(loss.item())
+        y_test_predicted = model(X_test_temp)
+        loss_with_test_data = criterion(input=y_test_predicted, target=y_test_temp).item()
 
-        y_test_predicted = torch.cat(y_test_predicted)
         y_test_predicted = torch.where(y_test_predicted > 0.5, 1, 0).detach().cpu().numpy()
 
         plot_title = 'Model Contourplot with Testdata'
@@ -552,9 +582,10 @@ def init(path, tb_logs_path):
     data_train_loader_new, data_test_loader_new = resample_data()
     X_train_new, y_train_new = dataloader_to_numpy(data_train_loader_new)
     X_test_new, y_test_new = dataloader_to_numpy(data_test_loader_new)
-    y_train_predicted_ = model(data_train_loader_new.dataset[:][0])
+    y_train_predicted_ = model(data_train_loader_new.dataset.tensors[0])
     y_train_predicted_ = torch.where(y_train_predicted_ > 0.5, 1, 0).detach().cpu().numpy().reshape(-1)
-    tree_accuracy_reg = build_decision_tree(X_train_new, y_train_predicted_, X_test_new, y_test_new, space, f"{path}/decision_tree_reg", min_samples_leaf=args.min_samples_leaf)
+    tree_accuracy_reg = build_decision_tree(X_train_new, y_train_predicted_, X_test_new, y_test_new, space, f"{path}/decision_tree_reg", min_samples_leaf=args.min_samples_leaf,
+                                            writer=writer, tag='Decision tree/After regularisation')
 
     # Final outputs
 
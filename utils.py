@@ -1,17 +1,17 @@
 # type: ignore
 # ruff: noqa
 
-import copy
+from io import BytesIO
+
 import torch
 from dtreeviz.trees import *
+from PIL import Image as ImagePIL
 from sklearn.tree import DecisionTreeClassifier
 from torch.utils.data import DataLoader, TensorDataset
 from sklearn.model_selection import cross_val_score
 from sklearn.metrics import accuracy_score
 from sklearn.tree import export_graphviz
 from six import StringIO
-from IPython.display import Image
-from PIL import Image as ImagePIL
 import pydotplus
 
 np.random.seed(5555)
@@ -50,18 +50,18 @@ def get_data_loader(X_train, y_train, X_test, y_test, X_val, y_val, X_type, y_ty
         data_val_loader : Data loader for validation data
     """
 
-    X_train = torch.tensor(X_train, dtype=X_type).to(device)
-    X_test = torch.tensor(X_test, dtype=X_type).to(device)
-    X_val = torch.tensor(X_val, dtype=X_type).to(device)
+    X_train = torch.as_tensor(X_train, dtype=X_type).to(device)
+    X_test = torch.as_tensor(X_test, dtype=X_type).to(device)
+    X_val = torch.as_tensor(X_val, dtype=X_type).to(device)
 
     if len(y_train.shape) <= 2:
-        y_train = torch.tensor(y_train.reshape(-1, 1), dtype=y_type).to(device)
-        y_test = torch.tensor(y_test.reshape(-1, 1), dtype=y_type).to(device)
-        y_val = torch.tensor(y_val.reshape(-1, 1), dtype=y_type).to(device)
+        y_train = torch.as_tensor(y_train.reshape(-1, 1), dtype=y_type).to(device)
+        y_test = torch.as_tensor(y_test.reshape(-1, 1), dtype=y_type).to(device)
+        y_val = torch.as_tensor(y_val.reshape(-1, 1), dtype=y_type).to(device)
     else:
-        y_train = torch.tensor(y_train, dtype=y_type).to(device)
-        y_test = torch.tensor(y_test, dtype=y_type).to(device)
-        y_val = torch.tensor(y_val, dtype=y_type).to(device)
+        y_train = torch.as_tensor(y_train, dtype=y_type).to(device)
+        y_test = torch.as_tensor(y_test, dtype=y_type).to(device)
+        y_val = torch.as_tensor(y_val, dtype=y_type).to(device)
 
     data_train = TensorDataset(X_train, y_train)
     data_train_loader = DataLoader(dataset=data_train, batch_size=batch_size, shuffle=True)
@@ -88,8 +88,8 @@ def dataloader_to_numpy(dataloader):
         y: Labels as numpy array
     """
 
-    X = dataloader.dataset[:][0].detach().cpu().numpy()
-    y = dataloader.dataset[:][1].detach().cpu().numpy()
+    X = dataloader.dataset.tensors[0].detach().cpu().numpy()
+    y = dataloader.dataset.tensors[1].detach().cpu().numpy()
 
     return X, y
 
@@ -105,7 +105,7 @@ def colormap(Y):
         -------
         colormap: color-coding for Y
     """
-    colormap = ['b' if y == 1 else 'r' for y in Y]
+    colormap = np.where(np.asarray(Y).ravel() == 1, 'b', 'r').tolist()
 
     return colormap
 
@@ -131,11 +131,12 @@ def post_pruning(X, y):
     clf = DecisionTreeClassifier(random_state=42)
     path = clf.cost_complexity_pruning_path(X, y)
     ccp_alphas, impurities = path.ccp_alphas, path.impurities
-    ccp_alphas = ccp_alphas[:-1]
+    # Duplicate alphas prune to the same tree, so cross-validate each candidate only once
+    ccp_alphas = np.unique(ccp_alphas[:-1])
     scores = []
     if len(ccp_alphas) != 0:
         for ccp_alpha in ccp_alphas:
-            clf = DecisionTreeClassifier(ccp_alpha=ccp_alpha)
+            clf = DecisionTreeClassifier(random_state=42, ccp_alpha=ccp_alpha)
             score = cross_val_score(clf, X, y, cv=5, scoring="neg_mean_squared_error", n_jobs=-1)
             scores.append(score)
 
@@ -151,7 +152,8 @@ def post_pruning(X, y):
     else:
         return 0.0
 
-def build_decision_tree(X_train, y_train, X_test, y_test, space, path, epoch=0, contour_plot=True, min_samples_leaf=1):
+def build_decision_tree(X_train, y_train, X_test, y_test, space, path, epoch=0, contour_plot=True, min_samples_leaf=1,
+                        render_tree=True, writer=None, tag=None):
     """Build tree given input data and save the corresponding tree plot and contour plot.
 
         Parameters
@@ -174,6 +176,14 @@ def build_decision_tree(X_train, y_train, X_test, y_test, space, path, epoch=0,
 
         min_samples_leaf: Pre-pruning method, default 1 (no pruning)
 
+        render_tree: Default True, if the tree plot should be rendered with Graphviz. Disable for periodic
+        snapshots, where the dot -> PNG pipeline dominates the cost of the snapshot
+
+        writer: TensorBoard SummaryWriter, default None. When given, the rendered tree plot is also logged
+        under tag, reusing the in-memory PNG bytes instead of reopening the file from disk
+
+        tag: Tag for the TensorBoard image entry, default None
+
         Returns
         -------
         accuracy: Accuracy measure of the decision tree using training and test set
@@ -186,18 +196,25 @@ def build_decision_tree(X_train, y_train, X_test, y_test, space, path, epoch=0,
     y_hat_tree = clf.predict(X_test)
     accuracy = accuracy_score(y_test, y_hat_tree)
 
-    dot_data = StringIO()
-    export_graphviz(
-        decision_tree=clf,
-        out_file=dot_data,
-        filled=True,
-        rounded=True,
-        special_characters=True,
-        feature_names=['x', 'y'],
-        class_names=['0', '1'])
-    graph = pydotplus.graph_from_dot_data(dot_data.getvalue())
-    graph.write_png(f'{path}.png')
-    Image(graph.create_png())
+    if render_tree:
+        dot_data = StringIO()
+        export_graphviz(
+            decision_tree=clf,
+            out_file=dot_data,
+            filled=True,
+            rounded=True,
+            special_characters=True,
+            feature_names=['x', 'y'],
+            class_names=['0', '1'])
+        graph = pydotplus.graph_from_dot_data(dot_data.getvalue())
+        png_bytes = graph.create_png()
+
+        with open(f'{path}.png', 'wb') as png_file:
+            png_file.write(png_bytes)
+
+        if writer is not None:
+            tree_image = np.asarray(ImagePIL.open(BytesIO(png_bytes)).convert('RGB'))
+            writer.add_image(tag, tree_image, epoch, dataformats='HWC')
 
     if contour_plot:
         xx, yy = np.meshgrid(np.linspace(space[0][0], space[0][1], 100),
@@ -233,14 +250,11 @@ def pred_contours(x, y, model):
     """
 
     data = np.c_[x.ravel(), y.ravel()]
-    y_pred = []
 
-    for d in data:
-        y_hat = model(torch.tensor(d, dtype=torch.float, device='mps'))
-        y_pred.append(y_hat.detach().cpu().numpy())
+    with torch.inference_mode():
+        y_hat = model(torch.as_tensor(data, dtype=torch.float, device=device))
 
-    y_pred = np.array(y_pred)
-    y_pred = np.where(y_pred > 0.5, 1, 0)
+    y_pred = np.where(y_hat.cpu().numpy() > 0.5, 1, 0)
 
     return y_pred
 
@@ -252,7 +266,7 @@ def augment_data_with_dirichlet(X_train, parameters, model, device, num_new_samp
         ----------
         X_train: Training data features
 
-        parameters: Set of model parameters
+        parameters: Set of model parameters, one parameter vector per row
 
         model: Target deep model
 
@@ -262,32 +276,35 @@ def augment_data_with_dirichlet(X_train, parameters, model, device, num_new_samp
 
         Returns
         -------
-        parameters_new: New synthetic parameter set
+        parameters_new: New synthetic parameter set, one parameter vector per row
 
         APLs_new: New synthetic APL estiamtes
     """
 
-    parameters_new = []
     APLs_new = []
 
-    alpha = [1] * len(parameters)
-    samples = np.random.dirichlet(alpha, num_new_samples)
-    parameters = torch.vstack(parameters).to(device)
-    samples = torch.from_numpy(samples).float().to(device)
-    parameters_ = samples @ parameters
+    # Sample the mixing weights with the torch sampler instead of np.random.dirichlet; the underlying
+    # aten::_sample_dirichlet op is not implemented on the MPS backend, so draw on the CPU there and transfer
+    sample_device = 'cpu' if device == 'mps' else device
+    alpha = torch.ones(len(parameters), device=sample_device)
+    samples = torch.distributions.Dirichlet(alpha).sample((num_new_samples,)).to(device)
+    parameters = parameters.detach().to(device)
+    parameters_new = samples @ parameters
 
     model.to(device)
     model.eval()
 
-    for param in parameters_:
-        model.vector_to_parameters(param)
-        APL = model.compute_APL(X_train)
+    # The tree fit inside compute_APL needs the features on the host; convert once for all samples
+    X_tree = X_train.detach().cpu().numpy()
+
+    with torch.no_grad():
+        for param in parameters_new:
+            model.vector_to_parameters(param)
+            APL = model.compute_APL(X_train, X_tree=X_tree)
 
-        parameters_new.append(param)
-        APLs_new.append(APL)
+            APLs_new.append(APL)
 
     del model
-    del parameters_
     del samples
 
     return parameters_new, APLs_new
@@ -319,21 +336,21 @@ def augment_data_with_gaussian(X_train, model, device, size):
     parameters = []
     APLs = []
 
-    for _ in range(size):
+    base_parameters = model.parameters_to_vector().detach()
+    X_tree = X_train.detach().cpu().numpy()
 
-        model_copy = copy.deepcopy(model)
-        model_copy.eval()
-
-        for param in model_copy.feed_forward.parameters():
-            param.data.requires_grad = False
+    model.to(device)
+    model.eval()
 
+    with torch.no_grad():
+        for _ in range(size):
             # variance: 0.1 - 0.3 times relative to the absolute value of the model parameter
-            param_augmented = np.random.normal(param.data.cpu().numpy(), 0.1 * np.abs(param.data.cpu().numpy()))
-            param.data = torch.tensor(param_augmented, dtype=torch.float).float().to(device)
+            param_augmented = torch.normal(base_parameters, 0.1 * base_parameters.abs())
+            model.vector_to_parameters(param_augmented)
 
-        parameters.append(model_copy.get_parameter_vector)
-        APLs.append(model_copy.compute_APL(X_train))
+            parameters.append(param_augmented)
+            APLs.append(model.compute_APL(X_train, X_tree=X_tree))
 
-        del model_copy
+    model.vector_to_parameters(base_parameters)
 
     return parameters, APLs